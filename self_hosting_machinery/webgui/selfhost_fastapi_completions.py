@@ -1,14 +1,14 @@
+import re
 import time
 import json
-import copy
 import asyncio
 import aiohttp
+import orjson
 import termcolor
 import os
-import litellm
 
 from fastapi import APIRouter, Request, HTTPException, Query
-from fastapi.responses import Response, StreamingResponse
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 
 from self_hosting_machinery import env
 from self_hosting_machinery.webgui.selfhost_model_resolve import completion_resolve_model
@@ -19,12 +19,30 @@ from self_hosting_machinery.webgui.selfhost_queue import InferenceQueue
 from self_hosting_machinery.webgui.selfhost_model_assigner import ModelAssigner
 
 from pydantic import BaseModel, Required
-from typing import List, Dict, Union
+from typing import Any, List, Dict, Optional, Tuple, Union
 
 
 __all__ = ["CompletionsRouter"]
 
 
+# asyncio.wait_for spawns and cancels a wrapper task per call, too wasteful for a
+# once-per-token wait; asyncio.timeout (3.11+) doesn't
+if hasattr(asyncio, "timeout"):
+    _queue_timeout = asyncio.timeout
+else:
+    from async_timeout import timeout as _queue_timeout
+
+
+# one pattern shared by all model fields; the old per-field "^[a-z/A-Z0-9_\.\-]+$"
+# had the "/" spliced into the middle of the a-z/A-Z ranges
+MODEL_RE = re.compile(r"^[A-Za-z0-9_./\-]+$")
+
+SSE_PREFIX = b"data: "
+SSE_SUFFIX = b"\n\n"
+SSE_DONE = b"data: [DONE]\n\n"
+SSE_ERROR = b"data: [ERROR]\n\n"
+
+
 def clamp(lower, upper, x):
     return max(lower, min(upper, x))
 
@@ -38,8 +56,12 @@ def chat_limit_messages(messages: List[Dict[str, str]]):
         raise HTTPException(status_code=400, detail="No messages")
     while len(messages) > 10:
         del messages[0:2]  # user, assistant
-    while sum([len(m["content"] + m["role"]) for m in messages]) > 8000:
+    lens = [len(m["content"]) + len(m["role"]) for m in messages]
+    total = sum(lens)
+    while total > 8000 and messages:
+        total -= sum(lens[0:2])
         del messages[0:2]  # user, assistant
+        del lens[0:2]
     return messages
 
 
@@ -66,7 +88,7 @@ class NlpSamplingParams(BaseModel):
 
 
 class NlpCompletion(NlpSamplingParams):
-    model: str = Query(default=Required, regex="^[a-z/A-Z0-9_\.\-]+$")
+    model: str = Query(default=Required, regex=MODEL_RE.pattern)
     prompt: str
     n: int = 1
     echo: bool = False
@@ -81,7 +103,7 @@ class POI(BaseModel):
 
 
 class DiffCompletion(NlpSamplingParams):
-    model: str = Query(default="", regex="^[a-z/A-Z0-9_\.\-]+$")
+    model: str = Query(default="", regex=MODEL_RE.pattern)
     intent: str
     sources: Dict[str, str]
     cursor_file: str
@@ -103,43 +125,63 @@ class ChatMessage(BaseModel):
 class ChatContext(NlpSamplingParams):
     messages: List[ChatMessage]
     n: int = 1
-    model: str = Query(default=Required, regex="^[a-z/A-Z0-9_\.\-]+$")
+    model: str = Query(default=Required, regex=MODEL_RE.pattern)
     function: str = Query(default="chat", regex="^[a-zA-Z0-9_\.\-]+$")
 
 
-async def _completion_streamer(ticket: Ticket, post: NlpCompletion, timeout, seen, created_ts, caps_version: int):
+def _drain_streaming_queue(queue: asyncio.Queue, msg: Dict) -> Dict:
+    # packets carry cumulative text, so if the producer got ahead of us only the
+    # newest one matters; a terminal status always wins over in_progress
+    while msg.get("status", "") == "in_progress":
+        try:
+            msg = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+    return msg
+
+
+async def _completion_streamer(ticket: Ticket, post: NlpCompletion, timeout: float, seen: List[str],
+                               created_ts: float, caps_version: int):
     try:
         packets_cnt = 0
         while 1:
             try:
-                msg = await asyncio.wait_for(ticket.streaming_queue.get(), timeout)
+                async with _queue_timeout(timeout):
+                    msg = await ticket.streaming_queue.get()
             except asyncio.TimeoutError:
                 log("TIMEOUT %s" % ticket.id())
                 msg = {"status": "error", "human_readable_message": "timeout"}
-            not_seen_resp = copy.deepcopy(msg)
-            not_seen_resp["caps_version"] = caps_version
+            msg = _drain_streaming_queue(ticket.streaming_queue, msg)
+            if not post.stream and msg.get("status", "") == "in_progress":
+                continue    # non-streaming clients only see the final packet, don't transform the rest
+            # deepcopy per packet is too slow, but the producer might still hold a
+            # reference to msg, so shallow-copy only what gets mutated below
+            not_seen_resp = {**msg, "caps_version": caps_version}
             if "choices" in not_seen_resp:
+                not_seen_resp["choices"] = [dict(c) for c in not_seen_resp["choices"]]
                 for i in range(post.n):
-                    newtext = not_seen_resp["choices"][i]["text"]
-                    if newtext.startswith(seen[i]):
-                        l = len(seen[i])
-                        tmp = not_seen_resp["choices"][i]["text"]
-                        not_seen_resp["choices"][i]["text"] = tmp[l:]
+                    choice = not_seen_resp["choices"][i]
+                    newtext = choice["text"]
+                    s = seen[i]
+                    if not s:
+                        # first packet, nothing to strip -- skip the no-op slice copy
+                        if post.stream:
+                            seen[i] = newtext
+                    elif newtext.startswith(s):
+                        choice["text"] = newtext[len(s):]
                         if post.stream:
-                            seen[i] = tmp
+                            seen[i] = newtext
                     else:
                         log("ooops seen doesn't work, might be infserver's fault")
             if not post.stream:
-                if msg.get("status", "") == "in_progress":
-                    continue
-                yield json.dumps(not_seen_resp)
+                yield orjson.dumps(not_seen_resp)
                 break
-            yield "data: " + json.dumps(not_seen_resp) + "\n\n"
+            yield SSE_PREFIX + orjson.dumps(not_seen_resp) + SSE_SUFFIX
             packets_cnt += 1
             if msg.get("status", "") != "in_progress":
                 break
         if post.stream:
-            yield "data: [DONE]" + "\n\n"
+            yield SSE_DONE
         log(red_time(created_ts) + " /finished %s, streamed %i packets" % (ticket.id(), packets_cnt))
         ticket.done()
         # fastapi_stats.stats_accum[kt] += msg.get("generated_tokens_n", 0)
@@ -153,31 +195,33 @@ async def _completion_streamer(ticket: Ticket, post: NlpCompletion, timeout, see
         ticket.cancelled = True
 
 
-async def chat_streamer(ticket: Ticket, timeout, created_ts):
-    seen: Dict[int, str] = dict()
+async def chat_streamer(ticket: Ticket, timeout: float, created_ts: float):
+    # upstream sends cumulative content, remembering how much was already
+    # streamed is enough -- no point keeping a full copy of it per choice
+    seen_len: Dict[int, int] = dict()
     try:
         while 1:
             try:
-                msg: Dict = await asyncio.wait_for(ticket.streaming_queue.get(), timeout)
+                async with _queue_timeout(timeout):
+                    msg: Dict = await ticket.streaming_queue.get()
             except asyncio.TimeoutError:
                 log("TIMEOUT %s" % ticket.id())
                 msg = {"status": "error", "human_readable_message": "timeout"}
+            msg = _drain_streaming_queue(ticket.streaming_queue, msg)
             if "choices" in msg:
                 for ch in msg["choices"]:
                     idx = ch["index"]
-                    seen_here = seen.get(idx, "")
                     content = ch.get("content", "")
-                    ch["delta"] = content[len(seen_here):]
-                    seen[idx] = content
+                    ch["delta"] = content[seen_len.get(idx, 0):]
+                    seen_len[idx] = len(content)
                     if "content" in ch:
                         del ch["content"]
-            tmp = json.dumps(msg)
-            yield "data: " + tmp + "\n\n"
+            tmp = orjson.dumps(msg)
+            yield SSE_PREFIX + tmp + SSE_SUFFIX
             log("  " + red_time(created_ts) + " stream %s <- %i bytes" % (ticket.id(), len(tmp)))
             if msg.get("status", "") != "in_progress":
                 break
-        await asyncio.sleep(0.5)   # a workaround for VS Code plugin bug, remove July 20, 2023 when plugin should be fixed
-        yield "data: [DONE]" + "\n\n"
+        yield SSE_DONE
         log(red_time(created_ts) + " /finished call %s" % ticket.id())
         ticket.done()
     finally:
@@ -187,10 +231,48 @@ async def chat_streamer(ticket: Ticket, timeout, created_ts):
         ticket.done()
 
 
+async def sse_batcher(agen, max_bytes: int = 8192, flush_interval: float = 0.01):
+    # Every yield from a streaming generator turns into a separate ASGI send; at high
+    # token rates that overhead dominates. Coalesce chunks that arrive within
+    # flush_interval (or until max_bytes) into one send.
+    buf = bytearray()
+    it = agen.__aiter__()
+    pending = None
+    try:
+        while 1:
+            if pending is None:
+                pending = asyncio.ensure_future(it.__anext__())
+            if not buf:
+                try:
+                    buf += await pending
+                except StopAsyncIteration:
+                    break
+                pending = None
+                continue
+            done, _ = await asyncio.wait({pending}, timeout=flush_interval)
+            if not done:
+                yield bytes(buf)
+                buf.clear()
+                continue
+            try:
+                buf += pending.result()
+            except StopAsyncIteration:
+                break
+            pending = None
+            if len(buf) >= max_bytes:
+                yield bytes(buf)
+                buf.clear()
+    finally:
+        if pending is not None:
+            pending.cancel()
+    if buf:
+        yield bytes(buf)
+
+
 async def error_string_streamer(ticket_id, static_message, account, created_ts):
-    yield "data: " + json.dumps(
-        {"object": "smc.chat.chunk", "role": "assistant", "delta": static_message, "finish_reason": "END"}) + "\n\n"
-    yield "data: [ERROR]" + "\n\n"
+    yield SSE_PREFIX + orjson.dumps(
+        {"object": "smc.chat.chunk", "role": "assistant", "delta": static_message, "finish_reason": "END"}) + SSE_SUFFIX
+    yield SSE_ERROR
     log("  " + red_time(created_ts) + "%s chat static message to %s: %s" % (ticket_id, account, static_message))
 
 
@@ -202,7 +284,7 @@ class CompletionsRouter(APIRouter):
                  model_assigner: ModelAssigner,
                  timeout: int = 30,
                  *args, **kwargs):
-        super().__init__(*args, **kwargs)
+        super().__init__(*args, default_response_class=ORJSONResponse, **kwargs)
 
         # API for direct FIM and Chat usage
         self.add_api_route("/v1/login", self._login, methods=["GET"])
@@ -220,28 +302,95 @@ class CompletionsRouter(APIRouter):
         self._id2ticket = id2ticket
         self._model_assigner = model_assigner
         self._timeout = timeout
+        # _login and _coding_assistant_caps are polled by IDE clients; their output only
+        # changes when the set of running models or the inference config changes
+        self._login_cache: Optional[Tuple[Any, Dict[str, Any]]] = None
+        self._caps_cache: Optional[Tuple[Any, Dict[str, Any]]] = None
+        self._caps_db_records: Optional[List[Tuple[Any, Dict[str, Any]]]] = None
+        self._integrations_env_cache: Optional[Tuple[Any, str]] = None
+        self._litellm_model_set: Optional[frozenset] = None
+        self._resolve_cache: Dict[str, Tuple[str, str]] = {}
+        self._resolve_cache_version: Optional[Tuple[int, Tuple[str, ...]]] = None
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self.add_event_handler("shutdown", self._shutdown_http_session)
+
+    async def _session(self) -> aiohttp.ClientSession:
+        # one pooled session for all requests, keeps connections to the LSP server alive
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=256, ttl_dns_cache=300, keepalive_timeout=60))
+        return self._http_session
+
+    async def _shutdown_http_session(self):
+        if self._http_session is not None:
+            await self._http_session.close()
+
+    def _resolve_model_cached(self, model: str, caps_version: int) -> Tuple[str, str]:
+        # clients send the same few model names over and over; resolution depends on
+        # the requested name and on models_available(), which lags CONFIG_INFERENCE by
+        # its own TTL -- key on both so a resolve against a stale model list isn't
+        # stored under the new config version forever
+        cache_version = (caps_version, tuple(self._inference_queue.models_available()))
+        if cache_version != self._resolve_cache_version:
+            self._resolve_cache.clear()
+            self._resolve_cache_version = cache_version
+        if model not in self._resolve_cache:
+            self._resolve_cache[model] = static_resolve_model(model, self._inference_queue)
+        return self._resolve_cache[model]
+
+    @property
+    def _litellm_models(self) -> frozenset:
+        if self._litellm_model_set is None:
+            # importing litellm pulls in a large dependency graph, keep it off the
+            # worker startup path and snapshot model_list for O(1) membership tests
+            import litellm
+            self._litellm_model_set = frozenset(litellm.model_list)
+        return self._litellm_model_set
 
     @staticmethod
-    def _interations_env_setup():
-        inference = {}
-        if os.path.exists(env.CONFIG_INFERENCE):
-            inference = json.load(open(env.CONFIG_INFERENCE, 'r'))
-        integrations = {}
-        if os.path.exists(env.CONFIG_INTEGRATIONS):
-            integrations = json.load(open(env.CONFIG_INTEGRATIONS, 'r'))
-        openai_api_key = integrations.get("openai_api_key", "") if inference.get("openai_api_enable", False) else ""
-        os.environ["OPENAI_API_KEY"] = openai_api_key
+    def _config_mtime_ns(path: str) -> int:
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _load_json_if_exists(path: str) -> Dict[str, Any]:
+        # json.load(open(...)) leaves closing the fd to the garbage collector
+        try:
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
+        except FileNotFoundError:
+            return {}
+
+    def _interations_env_setup(self):
+        # runs in the streaming generator before the first LLM call, so don't hit the
+        # disk unless one of the config files actually changed
+        cache_key = (self._config_mtime_ns(env.CONFIG_INFERENCE), self._config_mtime_ns(env.CONFIG_INTEGRATIONS))
+        if self._integrations_env_cache is None or self._integrations_env_cache[0] != cache_key:
+            inference = self._load_json_if_exists(env.CONFIG_INFERENCE)
+            integrations = self._load_json_if_exists(env.CONFIG_INTEGRATIONS)
+            openai_api_key = integrations.get("openai_api_key", "") if inference.get("openai_api_enable", False) else ""
+            self._integrations_env_cache = (cache_key, openai_api_key)
+        openai_api_key = self._integrations_env_cache[1]
+        if os.environ.get("OPENAI_API_KEY") != openai_api_key:
+            os.environ["OPENAI_API_KEY"] = openai_api_key
 
     async def _coding_assistant_caps(self):
-        models_available = self._inference_queue.models_available(force_read=True)
+        # models_available() caches for CACHE_MODELS_AVAILABLE seconds, good enough
+        # for polling endpoints -- no need to force a config re-read per request
+        models_available = self._inference_queue.models_available()
+        config_mtime = self._model_assigner.config_inference_mtime()
+        cache_key = (tuple(models_available), config_mtime)
+        if self._caps_cache is not None and self._caps_cache[0] == cache_key:
+            return Response(content=orjson.dumps(self._caps_cache[1], option=orjson.OPT_INDENT_2), media_type="application/json")
         code_completion_default_model, _ = completion_resolve_model(self._inference_queue)
         code_chat_default_model = ""
         for model_name in models_available:
             if "chat" in self._model_assigner.models_db.get(model_name, {}).get("filter_caps", []) \
-                    or model_name in litellm.model_list:
+                    or model_name in self._litellm_models:
                 code_chat_default_model = model_name
                 break
-        config_mtime = self._model_assigner.config_inference_mtime()
         data = {
             "cloud_name": "Refact Self-Hosted",
             "endpoint_template": "/v1/completions",
@@ -260,9 +409,14 @@ class CompletionsRouter(APIRouter):
             },
             "caps_version": config_mtime,
         }
-        return Response(content=json.dumps(data, indent=4), media_type="application/json")
+        self._caps_cache = (cache_key, data)
+        return Response(content=orjson.dumps(data, option=orjson.OPT_INDENT_2), media_type="application/json")
 
     async def _login(self):
+        models_available = self._inference_queue.models_available()
+        cache_key = (tuple(models_available), self._model_assigner.config_inference_mtime())
+        if self._login_cache is not None and self._login_cache[0] == cache_key:
+            return ORJSONResponse(self._login_cache[1])
         longthink_functions = dict()
         longthink_filters = set()
         models_mini_db_extended = {
@@ -273,10 +427,13 @@ class CompletionsRouter(APIRouter):
         }
         filter_caps = set([
             capability
-            for model in self._inference_queue.models_available(force_read=True)
+            for model in models_available
             for capability in models_mini_db_extended.get(model, {}).get("filter_caps", [])
         ])
-        for rec in self._model_assigner.models_caps_db:
+        if self._caps_db_records is None:
+            # models_caps_db is a static module-level list, serialize each record once
+            self._caps_db_records = [(rec, rec.to_dict()) for rec in self._model_assigner.models_caps_db]
+        for rec, rec_dict in self._caps_db_records:
             rec_modelcaps = rec.model if isinstance(rec.model, list) else [rec.model]
             rec_third_parties = rec.third_party if isinstance(rec.third_party, list) else [rec.third_party]
             for rec_modelcap, rec_third_party in zip(rec_modelcaps, rec_third_parties):
@@ -290,7 +447,7 @@ class CompletionsRouter(APIRouter):
                     assert err_msg == "", err_msg
                 rec_function_name = f"{rec.function_name}-{rec_modelcap}"
                 longthink_functions[rec_function_name] = {
-                    **rec.to_dict(),
+                    **rec_dict,
                     "function_name": rec_function_name,
                     "is_liked": False,
                     "likes": 0,
@@ -299,7 +456,7 @@ class CompletionsRouter(APIRouter):
                 }
                 if "/" not in rec_model:
                     longthink_filters.add(rec_model)
-        return {
+        payload = {
             "account": "self-hosted",
             "retcode": "OK",
             "longthink-functions-today": 1,
@@ -307,18 +464,20 @@ class CompletionsRouter(APIRouter):
             "longthink-filters": list(longthink_filters),
             "chat-v1-style": 1,
         }
+        self._login_cache = (cache_key, payload)
+        return ORJSONResponse(payload)
 
     async def _secret_key_activate(self):
-        return {
+        return ORJSONResponse({
             "retcode": "OK",
             "human_readable_message": "API key verified",
-        }
+        })
 
     async def _completions(self, post: NlpCompletion, account: str = "user"):
         ticket = Ticket("comp-")
         req = post.clamp()
         caps_version = self._model_assigner.config_inference_mtime()       # use mtime as a version, if that changes the client will know to refresh caps
-        model_name, err_msg = static_resolve_model(post.model, self._inference_queue)
+        model_name, err_msg = self._resolve_model_cached(post.model, caps_version)
         if err_msg:
             log("%s model resolve \"%s\" -> error \"%s\" from %s" % (ticket.id(), post.model, err_msg, account))
             return Response(status_code=400, content=json.dumps({"detail": err_msg, "caps_version": caps_version}, indent=4), media_type="application/json")
@@ -345,7 +504,8 @@ class CompletionsRouter(APIRouter):
     async def _chat(self, post: ChatContext, request: Request, account: str = "user"):
         ticket = Ticket("comp-")
 
-        model_name, err_msg = static_resolve_model(post.model, self._inference_queue)
+        caps_version = self._model_assigner.config_inference_mtime()
+        model_name, err_msg = self._resolve_model_cached(post.model, caps_version)
         if err_msg:
             log("%s model resolve \"%s\" -> error \"%s\" from %s" % (ticket.id(), post.model, err_msg, account))
             raise HTTPException(status_code=400, detail=err_msg)
@@ -376,19 +536,21 @@ class CompletionsRouter(APIRouter):
 
     async def _models(self):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("http://127.0.0.1:8001/v1/caps") as resp:
-                    lsp_server_caps = await resp.json()
+            session = await self._session()
+            async with session.get("http://127.0.0.1:8001/v1/caps") as resp:
+                lsp_server_caps = await resp.json()
         except aiohttp.ClientConnectorError as e:
             err_msg = f"LSP server is not ready yet: {e}"
             log(err_msg)
             raise HTTPException(status_code=401, detail=err_msg)
         completion_models = set()
         for model, caps in lsp_server_caps["code_completion_models"].items():
-            completion_models.update({model, *caps["similar_models"]})
+            completion_models.add(model)
+            completion_models.update(caps["similar_models"])
         chat_models = set()
         for model, caps in lsp_server_caps["code_chat_models"].items():
-            chat_models.update({model, *caps["similar_models"]})
+            chat_models.add(model)
+            chat_models.update(caps["similar_models"])
         data = [
             {
                 "id": model, "root": model, "object": "model",
@@ -397,17 +559,16 @@ class CompletionsRouter(APIRouter):
             }
             for model in lsp_server_caps["running_models"]
         ]
-        return {
+        return ORJSONResponse({
             "object": "list",
             "data": data,
-        }
+        })
 
     async def _chat_completions(self, post: ChatContext, account: str = "user"):
-        prefix, postfix = "data: ", "\n\n"
-
-        if post.model in litellm.model_list:
+        if post.model in self._litellm_models:
             async def litellm_streamer(post: ChatContext):
                 try:
+                    import litellm
                     self._interations_env_setup()
                     response = await litellm.acompletion(
                         model=post.model, messages=post.messages, stream=True,
@@ -419,13 +580,13 @@ class CompletionsRouter(APIRouter):
                             finish_reason = data["choices"][0]["finish_reason"]
                         except json.JSONDecodeError:
                             data = {"choices": [{"finish_reason": finish_reason}]}
-                        yield prefix + json.dumps(data) + postfix
+                        yield SSE_PREFIX + orjson.dumps(data) + SSE_SUFFIX
                     # NOTE: DONE neededed by refact-lsp server
-                    yield prefix + "[DONE]" + postfix
+                    yield SSE_DONE
                 except BaseException as e:
                     err_msg = f"litellm error: {e}"
                     log(err_msg)
-                    yield prefix + json.dumps({"error": err_msg}) + postfix
+                    yield SSE_PREFIX + orjson.dumps({"error": err_msg}) + SSE_SUFFIX
 
             response_streamer = litellm_streamer(post)
 
@@ -441,24 +602,35 @@ class CompletionsRouter(APIRouter):
                         "max_new_tokens": post.max_tokens,
                     }
                 }
-                async with aiohttp.ClientSession() as session:
-                    try:
-                        async with session.post(post_url, json=post_data) as response:
-                            finish_reason = None
-                            async for data, _ in response.content.iter_chunks():
+                session = await self._session()
+                try:
+                    async with session.post(post_url, json=post_data) as response:
+                        finish_reason = None
+                        buf = bytearray()
+                        async for chunk in response.content.iter_any():
+                            # aiohttp chunks are not guaranteed to line up with SSE
+                            # frames, buffer and split on the frame separator
+                            buf += chunk
+                            while (frame_end := buf.find(SSE_SUFFIX)) >= 0:
+                                frame = bytes(buf[:frame_end])
+                                del buf[:frame_end + 2]
+                                payload = frame[len(SSE_PREFIX):] if frame.startswith(SSE_PREFIX) else frame
                                 try:
-                                    data = data.decode("utf-8")
-                                    data = json.loads(data[len(prefix):-len(postfix)])
+                                    data = orjson.loads(payload)
                                     finish_reason = data["choices"][0]["finish_reason"]
+                                except orjson.JSONDecodeError:
+                                    yield SSE_PREFIX + orjson.dumps({"choices": [{"finish_reason": finish_reason}]}) + SSE_SUFFIX
+                                    continue
+                                if finish_reason is None:
+                                    yield frame + SSE_SUFFIX    # nothing to rewrite, forward as-is
+                                else:
                                     data["choices"][0]["finish_reason"] = None
-                                except json.JSONDecodeError:
-                                    data = {"choices": [{"finish_reason": finish_reason}]}
-                                yield prefix + json.dumps(data) + postfix
-                    except aiohttp.ClientConnectorError as e:
-                        err_msg = f"LSP server is not ready yet: {e}"
-                        log(err_msg)
-                        yield prefix + json.dumps({"error": err_msg}) + postfix
+                                    yield SSE_PREFIX + orjson.dumps(data) + SSE_SUFFIX
+                except aiohttp.ClientConnectorError as e:
+                    err_msg = f"LSP server is not ready yet: {e}"
+                    log(err_msg)
+                    yield SSE_PREFIX + orjson.dumps({"error": err_msg}) + SSE_SUFFIX
 
             response_streamer = chat_completion_streamer(post)
 
-        return StreamingResponse(response_streamer, media_type="text/event-stream")
+        return StreamingResponse(sse_batcher(response_streamer), media_type="text/event-stream")
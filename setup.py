@@ -43,7 +43,8 @@ all_refact_packages = {
         data=["git_command.exp"],
     ),
     "self_hosting_machinery": PyPackage(
-        requires=["aiohttp", "aiofiles", "cryptography", "fastapi==0.100.0", "giturlparse", "pydantic==1.10.13",
+        requires=["aiohttp", "aiofiles", "async_timeout", "cryptography", "fastapi==0.100.0", "giturlparse", "orjson",
+                  "pydantic==1.10.13",
                   "starlette==0.27.0", "uvicorn", "uvloop", "python-multipart", "auto-gptq==0.6.0", "accelerate",
                   "termcolor", "torch", "transformers==4.36.2", "bitsandbytes", "safetensors", "peft", "triton",
                   "torchinfo", "mpi4py", "deepspeed==0.12.6", "cassandra_driver==3.28.0", "pandas>=2.0.3", "litellm"],